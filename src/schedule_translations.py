@@ -0,0 +1,662 @@
+import os
+import glob
+import json
+import time
+import heapq
+import argparse
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+
+from translate_srt_batch import (
+    API_KEY,
+    BASE_URL,
+    DEFAULT_MODEL,
+    DEFAULT_TEMPERATURE,
+    DEFAULT_CONTEXT_TOKENS,
+    DEFAULT_GLOSSARY_TOKENS,
+    DEFAULT_BATCH_GLOSSARY_TOKENS,
+    ContextBudget,
+    estimate_tokens,
+    parse_srt,
+    write_srt,
+    create_batch_groups,
+    load_glossary,
+    build_system_prompt,
+    translate_with_glossary,
+)
+
+# --- Configuration ---
+
+# USD per 1M tokens. Override or extend with --pricing for other models/providers.
+MODEL_PRICING = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4.1": {"input": 2.00, "cached_input": 0.50, "output": 8.00},
+    "gpt-4.1-mini": {"input": 0.40, "cached_input": 0.10, "output": 1.60},
+    "gpt-3.5-turbo": {"input": 0.50, "cached_input": 0.50, "output": 1.50},
+}
+
+BATCH_SIZE_CHOICES = (10, 20, 30)
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_PRIORITY = 0
+
+# Initial throughput assumptions, recalibrated from observed batch times during a run
+DEFAULT_BATCH_LATENCY = 2.0  # seconds of fixed overhead per request
+DEFAULT_OUTPUT_TPS = 50.0  # generated tokens per second
+OUTPUT_TOKEN_RATIO = 1.5  # Chinese output tokens per English input token
+SPEED_SMOOTHING = 0.3
+# Prefixes shorter than this are not cached by the provider (1024 tokens on OpenAI)
+DEFAULT_MIN_CACHE_TOKENS = 1024
+
+# --- Jobs and Estimation ---
+
+class TranslationJob:
+    """A single subtitle file to translate, with its priority and deadline."""
+    def __init__(self, input_path, output_path, subtitles, priority=DEFAULT_PRIORITY, deadline=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.subtitles = subtitles
+        self.priority = priority
+        self.deadline = deadline
+        self.estimates = {}
+
+    def sort_key(self):
+        """Earliest deadline first, then highest priority."""
+        deadline = self.deadline or datetime.max
+        return (deadline, -self.priority, self.input_path)
+
+def parse_deadline(value, now=None):
+    """
+    Parses a deadline given as "HH:MM" (next occurrence) or "YYYY-MM-DD HH:MM".
+
+    Deadlines with a UTC offset are converted to naive local time so they
+    compare with datetime.now().
+
+    Returns:
+        datetime, or None if value is empty
+
+    Raises:
+        ValueError: if value is not a recognised deadline
+    """
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid deadline {value!r}")
+    now = now or datetime.now()
+    try:
+        clock = datetime.strptime(value, "%H:%M")
+    except ValueError:
+        try:
+            deadline = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid deadline {value!r}, expected \"HH:MM\" or \"YYYY-MM-DD HH:MM\"")
+        if deadline.tzinfo is not None:
+            deadline = deadline.astimezone().replace(tzinfo=None)
+        return deadline
+    deadline = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return deadline
+
+def estimate_batch_tokens(batches, prefix_tokens, context_tokens, batch_glossary_tokens=0,
+                          min_cache_tokens=DEFAULT_MIN_CACHE_TOKENS):
+    """
+    Estimates token usage of each batch before any request is sent.
+
+    The stable prefix is assumed to be served from the provider cache for
+    every batch after the first one of a file, provided it is at least
+    min_cache_tokens long. The per-batch glossary slice is counted at its
+    full allowance.
+
+    Returns:
+        List of (prompt_tokens, cached_tokens, completion_tokens) tuples
+    """
+    estimates = []
+    for i, batch in enumerate(batches):
+        batch_tokens = sum(estimate_tokens(f"{n}. {sub.text}") + 1 for n, sub in enumerate(batch, 1))
+        context = min(context_tokens, batch_tokens) if i else 0
+        prompt_tokens = prefix_tokens + context + batch_glossary_tokens + batch_tokens
+        cached_tokens = prefix_tokens if i and prefix_tokens >= min_cache_tokens else 0
+        completion_tokens = int(batch_tokens * OUTPUT_TOKEN_RATIO)
+        estimates.append((prompt_tokens, cached_tokens, completion_tokens))
+    return estimates
+
+def batch_cost(pricing, prompt_tokens, cached_tokens, completion_tokens):
+    """Returns the USD cost of a request given its token counts."""
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * pricing["input"]
+            + cached_tokens * pricing.get("cached_input", pricing["input"])
+            + completion_tokens * pricing["output"]) / 1_000_000
+
+def batch_seconds(completion_tokens, speed_factor=1.0):
+    """Returns the predicted wall-clock seconds of a request."""
+    return (DEFAULT_BATCH_LATENCY + completion_tokens / DEFAULT_OUTPUT_TPS) * speed_factor
+
+# --- Planning ---
+
+def simulate_schedule(jobs, batch_size, concurrency, pricing, start, speed_factor=1.0):
+    """
+    Simulates running jobs in order on a pool of workers, one file per worker.
+
+    Returns:
+        Tuple of (total_cost, finish_time, late_jobs)
+    """
+    workers = [start] * concurrency
+    heapq.heapify(workers)
+    total_cost = 0.0
+    finish_time = start
+    late_jobs = []
+
+    for job in jobs:
+        estimates = job.estimates[batch_size]
+        seconds = sum(batch_seconds(c, speed_factor) for _, _, c in estimates)
+        total_cost += sum(batch_cost(pricing, *e) for e in estimates)
+
+        job_start = heapq.heappop(workers)
+        job_end = job_start + timedelta(seconds=seconds)
+        heapq.heappush(workers, job_end)
+
+        finish_time = max(finish_time, job_end)
+        if job.deadline and job_end > job.deadline:
+            late_jobs.append(job)
+
+    return total_cost, finish_time, late_jobs
+
+def plan_schedule(jobs, models, pricing_table, budget_usd=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, start=None):
+    """
+    Picks model, batch size and concurrency for a set of jobs.
+
+    Models are tried in the given order of preference. For each model the
+    smallest batch size and concurrency that meet every deadline are chosen,
+    as long as the predicted cost stays within the budget. If no setting meets
+    both, the plan within budget with the fewest late jobs is returned; if
+    nothing fits the budget, the cheapest plan is returned. Without any
+    deadlines, the full concurrency is used.
+
+    Returns:
+        Dict with model, batch_size, concurrency, cost, finish_time, late_jobs and feasible
+    """
+    start = start or datetime.now()
+    candidates = []
+    if any(job.deadline for job in jobs):
+        concurrency_choices = range(1, max_concurrency + 1)
+    else:
+        concurrency_choices = [max_concurrency]
+
+    for model in models:
+        pricing = pricing_table[model]
+        for batch_size in BATCH_SIZE_CHOICES:
+            for concurrency in concurrency_choices:
+                cost, finish_time, late_jobs = simulate_schedule(jobs, batch_size, concurrency, pricing, start)
+                plan = {
+                    "model": model,
+                    "batch_size": batch_size,
+                    "concurrency": concurrency,
+                    "cost": cost,
+                    "finish_time": finish_time,
+                    "late_jobs": late_jobs,
+                    "feasible": not late_jobs and (budget_usd is None or cost <= budget_usd),
+                }
+                if plan["feasible"]:
+                    return plan
+                candidates.append(plan)
+
+    within_budget = [p for p in candidates if budget_usd is None or p["cost"] <= budget_usd]
+    if within_budget:
+        return min(within_budget, key=lambda p: (len(p["late_jobs"]), p["finish_time"]))
+    return min(candidates, key=lambda p: (p["cost"], p["finish_time"]))
+
+# --- Progress Tracking ---
+
+class ScheduleTracker:
+    """
+    Tracks spend and throughput during a run and predicts finish time and cost.
+
+    With enforce_budget set, jobs and batches are only started while spent
+    plus committed cost stays within the budget. Concurrency starts at the
+    planned value and is raised up to max_concurrency when a job is
+    predicted to miss its deadline.
+    """
+    def __init__(self, jobs, plan, models, pricing_table, budget_usd=None, enforce_budget=True,
+                 max_concurrency=None):
+        self.jobs = jobs
+        self.plan = plan
+        self.models = models
+        self.pricing_table = pricing_table
+        self.budget_usd = budget_usd
+        self.enforce_budget = enforce_budget and budget_usd is not None
+        self.speed_factor = 1.0
+        self.concurrency = plan["concurrency"]
+        self.max_concurrency = max(max_concurrency or 0, self.concurrency)
+        self.running = 0
+        self.queue = deque(jobs)
+        self.lock = threading.Lock()
+        self.slots = threading.Condition(self.lock)
+        self.flagged_jobs = []
+        self.job_models = {}
+        self.job_usage = {}
+        self.job_done_batches = {job: 0 for job in jobs}
+        self.skipped_jobs = []
+        self.stopped_jobs = []
+
+    def _job_spent(self, job):
+        usage = self.job_usage.get(job)
+        if not usage:
+            return 0.0
+        pricing = self.pricing_table[self.job_models[job]]
+        return batch_cost(pricing, usage.get("prompt_tokens", 0),
+                          usage.get("cached_tokens", 0), usage.get("completion_tokens", 0))
+
+    def _remaining(self, job):
+        return job.estimates[self.plan["batch_size"]][self.job_done_batches[job]:]
+
+    def _cost_factor(self):
+        """Ratio of actual spend to the up-front estimate for the batches finished so far."""
+        estimated = 0.0
+        for job, model in self.job_models.items():
+            done = job.estimates[self.plan["batch_size"]][:self.job_done_batches[job]]
+            estimated += sum(batch_cost(self.pricing_table[model], *e) for e in done)
+        return self.spent() / estimated if estimated else 1.0
+
+    def _remaining_cost(self, job, model):
+        pricing = self.pricing_table[model]
+        return sum(batch_cost(pricing, *e) for e in self._remaining(job)) * self._cost_factor()
+
+    def _committed(self):
+        """Spent so far plus the estimated cost of finishing every job already started."""
+        committed = self.spent()
+        for started, model in self.job_models.items():
+            if started not in self.stopped_jobs:
+                committed += self._remaining_cost(started, model)
+        return committed
+
+    def _predict_finishes(self, now):
+        """Simulates the remaining work on the current number of workers and returns each job's finish time."""
+        finishes = {}
+        workers = []
+        for job in self.job_models:
+            remaining = self._remaining(job)
+            if remaining and job not in self.stopped_jobs:
+                seconds = sum(batch_seconds(e[2], self.speed_factor) for e in remaining)
+                finishes[job] = now + timedelta(seconds=seconds)
+                workers.append(finishes[job])
+        workers += [now] * max(self.concurrency - len(workers), 0)
+        heapq.heapify(workers)
+
+        for job in self.jobs:
+            if job in self.job_models or job in self.skipped_jobs:
+                continue
+            seconds = sum(batch_seconds(e[2], self.speed_factor) for e in self._remaining(job))
+            finishes[job] = heapq.heappop(workers) + timedelta(seconds=seconds)
+            heapq.heappush(workers, finishes[job])
+        return finishes
+
+    def spent(self):
+        return sum(self._job_spent(job) for job in self.jobs)
+
+    def next_job(self):
+        """
+        Blocks until fewer than the current concurrency limit of jobs are running,
+        then takes the next job in deadline and priority order.
+
+        Returns:
+            TranslationJob, or None when every job has been handed out
+        """
+        with self.slots:
+            while self.queue and self.running >= self.concurrency:
+                self.slots.wait()
+            if not self.queue:
+                return None
+            self.running += 1
+            return self.queue.popleft()
+
+    def release_slot(self):
+        with self.slots:
+            self.running -= 1
+            self.slots.notify_all()
+
+    def choose_model(self, job):
+        """
+        Picks the model for a job as it starts, falling back to cheaper models
+        when the projected spend would exceed the budget.
+
+        Returns:
+            Tuple of (model, usage_stats), or (None, None) if the job does not fit the budget
+        """
+        with self.lock:
+            model = self.plan["model"]
+            if self.budget_usd is not None:
+                committed = self._committed()
+                pending = [j for j in self.jobs
+                           if j not in self.job_models and j not in self.skipped_jobs]
+                candidates = [model] + [m for m in self.models if m != model]
+
+                # Prefer a model that leaves room for every pending job, then one that fits this job alone
+                fitting = [m for m in candidates
+                           if committed + sum(self._remaining_cost(j, m) for j in pending) <= self.budget_usd]
+                if not fitting:
+                    fitting = [m for m in candidates
+                               if committed + self._remaining_cost(job, m) <= self.budget_usd]
+
+                if fitting:
+                    model = fitting[0]
+                elif self.enforce_budget:
+                    print(f"[scheduler] Skipping {os.path.basename(job.input_path)}: "
+                          f"it would exceed the ${self.budget_usd:.4f} budget")
+                    self.skipped_jobs.append(job)
+                    return None, None
+                else:
+                    model = min(self.models, key=lambda m: self._remaining_cost(job, m))
+
+                if model != self.plan["model"]:
+                    print(f"[scheduler] Switching {os.path.basename(job.input_path)} to {model} to stay within budget")
+
+            self.job_models[job] = model
+            self.job_usage[job] = {}
+            return model, self.job_usage[job]
+
+    def on_batch(self, job, batch_number, elapsed):
+        """
+        Recalibrates throughput after a batch and prints the predicted finish time and cost.
+
+        Returns:
+            False if the job should stop before its next batch to stay within budget
+        """
+        with self.lock:
+            self.job_done_batches[job] = batch_number
+            _, _, completion_tokens = job.estimates[self.plan["batch_size"]][batch_number - 1]
+            ratio = elapsed / batch_seconds(completion_tokens)
+            self.speed_factor += SPEED_SMOOTHING * (ratio - self.speed_factor)
+
+            spent = self.spent()
+            remaining_cost = 0.0
+            for other in self.jobs:
+                if other in self.skipped_jobs or other in self.stopped_jobs:
+                    continue
+                remaining_cost += self._remaining_cost(other, self.job_models.get(other, self.plan["model"]))
+
+            now = datetime.now()
+            finishes = self._predict_finishes(now)
+            late_jobs = [j for j, finish in finishes.items() if j.deadline and finish > j.deadline]
+            pending = [j for j in late_jobs if j not in self.job_models]
+            while pending and self.concurrency < self.max_concurrency:
+                # Only jobs that have not started can be sped up by running more files in parallel
+                self.concurrency += 1
+                self.slots.notify_all()
+                print(f"[scheduler] Raising concurrency to {self.concurrency} to meet deadlines")
+                finishes = self._predict_finishes(now)
+                late_jobs = [j for j, finish in finishes.items() if j.deadline and finish > j.deadline]
+                pending = [j for j in late_jobs if j not in self.job_models]
+
+            for late in late_jobs:
+                if late not in self.flagged_jobs:
+                    self.flagged_jobs.append(late)
+                    print(f"[scheduler] Warning: {os.path.basename(late.input_path)} is predicted to finish at "
+                          f"{finishes[late]:%Y-%m-%d %H:%M:%S}, after its deadline {late.deadline:%Y-%m-%d %H:%M}")
+
+            eta = max(finishes.values(), default=now)
+            budget_note = f" / ${self.budget_usd:.4f}" if self.budget_usd is not None else ""
+            print(f"[scheduler] Spent ${spent:.4f}, predicted total ${spent + remaining_cost:.4f}{budget_note}, "
+                  f"predicted finish {eta:%Y-%m-%d %H:%M:%S}")
+
+            if self.enforce_budget and self._committed() > self.budget_usd and self._remaining(job):
+                print(f"[scheduler] Stopping {os.path.basename(job.input_path)}: "
+                      f"finishing it would exceed the ${self.budget_usd:.4f} budget")
+                self.stopped_jobs.append(job)
+                return False
+            return True
+
+# --- Job Loading ---
+
+def collect_jobs(inputs, jobs_file=None, default_deadline=None, default_priority=DEFAULT_PRIORITY):
+    """
+    Builds TranslationJob objects from SRT files, folders and an optional jobs file.
+
+    The jobs file is a JSON list of {"file", "priority", "deadline", "output_file"} objects.
+
+    Returns:
+        List of TranslationJob objects
+    """
+    # Keyed by absolute input path so a file is only translated once; jobs-file entries win
+    specs = {}
+    for path in inputs:
+        if os.path.isdir(path):
+            for file_path in sorted(glob.glob(os.path.join(path, "*.srt"))):
+                if not file_path.endswith("_cn.srt"):
+                    specs[os.path.abspath(file_path)] = {"file": file_path, "deadline": default_deadline}
+        else:
+            specs[os.path.abspath(path)] = {"file": path, "deadline": default_deadline}
+
+    if jobs_file:
+        entries = []
+        try:
+            with open(jobs_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load jobs file {jobs_file}: {e}")
+        if not isinstance(entries, list):
+            print(f"Warning: Jobs file {jobs_file} must contain a JSON list, ignoring it.")
+            entries = []
+
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get("file"), str):
+                print(f"Skipping jobs file entry without a \"file\": {entry!r}")
+                continue
+            if not isinstance(entry.get("priority", default_priority), int):
+                print(f"Skipping jobs file entry for {entry['file']}: priority must be an integer.")
+                continue
+            try:
+                deadline = parse_deadline(entry["deadline"]) if entry.get("deadline") else default_deadline
+            except ValueError as e:
+                print(f"Skipping jobs file entry for {entry['file']}: {e}")
+                continue
+            specs[os.path.abspath(entry["file"])] = dict(entry, deadline=deadline)
+
+    jobs = []
+    for spec in specs.values():
+        input_path = spec["file"]
+        subtitles = parse_srt(input_path)
+        if not subtitles:
+            print(f"Skipping {input_path}: no subtitles parsed.")
+            continue
+
+        output_path = spec.get("output_file")
+        if not output_path:
+            base, ext = os.path.splitext(input_path)
+            output_path = f"{base}_cn{ext}"
+
+        jobs.append(TranslationJob(input_path, output_path, subtitles,
+                                   spec.get("priority", default_priority), spec["deadline"]))
+
+    return jobs
+
+def is_price(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+def load_pricing(pricing_file=None):
+    """
+    Returns the model pricing table, extended with an optional JSON pricing file.
+
+    The pricing file maps model names to {"input", "output", "cached_input"} prices;
+    entries without numeric input and output prices are skipped.
+    """
+    pricing_table = dict(MODEL_PRICING)
+    if not pricing_file:
+        return pricing_table
+
+    entries = {}
+    try:
+        with open(pricing_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load pricing file {pricing_file}: {e}")
+    if not isinstance(entries, dict):
+        print(f"Warning: Pricing file {pricing_file} must contain a JSON object, ignoring it.")
+        entries = {}
+
+    for model, pricing in entries.items():
+        if (not isinstance(pricing, dict) or not is_price(pricing.get("input"))
+                or not is_price(pricing.get("output"))
+                or ("cached_input" in pricing and not is_price(pricing["cached_input"]))):
+            print(f"Skipping pricing for {model}: expected non-negative numeric \"input\" and \"output\" prices.")
+            continue
+        pricing_table[model] = pricing
+    return pricing_table
+
+# --- Main Logic ---
+
+def main():
+    """Main function to schedule translation of many SRT files against a deadline and budget."""
+    parser = argparse.ArgumentParser(description='Translate many SRT files, planning concurrency, batch size and model to meet a deadline and budget.')
+    parser.add_argument('inputs', nargs='*', help='SRT files or folders containing SRT files.')
+    parser.add_argument('-j', '--jobs', help='Optional JSON file listing jobs with per-file priority and deadline.')
+    parser.add_argument('-d', '--deadline', help='Deadline for all jobs, as "HH:MM" or "YYYY-MM-DD HH:MM".')
+    parser.add_argument('--budget', type=float, help='Maximum spend in USD for the whole run.')
+    parser.add_argument('-m', '--models', default=DEFAULT_MODEL, help=f'Comma-separated models in order of preference. Defaults to {DEFAULT_MODEL}.')
+    parser.add_argument('-p', '--priority', type=int, default=DEFAULT_PRIORITY, help='Default priority for jobs; higher runs first among equal deadlines.')
+    parser.add_argument('-c', '--max_concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY, help=f'Maximum number of files translated in parallel. Defaults to {DEFAULT_MAX_CONCURRENCY}.')
+    parser.add_argument('--pricing', help='Optional JSON file with per-model prices in USD per 1M tokens.')
+    parser.add_argument('-t', '--temperature', type=float, default=DEFAULT_TEMPERATURE, help=f'The temperature for translation. Defaults to {DEFAULT_TEMPERATURE}.')
+    parser.add_argument('-g', '--glossary', help='Optional JSON glossary file for consistent terminology translation.')
+    parser.add_argument('--context_tokens', type=int, default=DEFAULT_CONTEXT_TOKENS, help=f'Token allowance for context memory per batch. Defaults to {DEFAULT_CONTEXT_TOKENS}.')
+    parser.add_argument('--glossary_tokens', type=int, default=DEFAULT_GLOSSARY_TOKENS, help=f'Token allowance for the fixed glossary block in the cached prefix. Defaults to {DEFAULT_GLOSSARY_TOKENS}.')
+    parser.add_argument('--batch_glossary_tokens', type=int, default=DEFAULT_BATCH_GLOSSARY_TOKENS, help=f'Token allowance for glossary terms matched per batch outside the fixed block. Defaults to {DEFAULT_BATCH_GLOSSARY_TOKENS}.')
+    parser.add_argument('--min_cache_tokens', type=int, default=DEFAULT_MIN_CACHE_TOKENS, help=f'Shortest prompt prefix the provider caches, used for cost estimates. Defaults to {DEFAULT_MIN_CACHE_TOKENS}.')
+    parser.add_argument('--allow_over_budget', action='store_true', help='Run even if the predicted cost exceeds --budget, and do not stop jobs when spend reaches it.')
+    parser.add_argument('--dry_run', action='store_true', help='Only print the plan without translating.')
+
+    args = parser.parse_args()
+
+    if args.max_concurrency < 1:
+        print("Error: --max_concurrency must be at least 1.")
+        return
+    if args.budget is not None and args.budget <= 0:
+        print("Error: --budget must be greater than 0.")
+        return
+    for name in ('context_tokens', 'glossary_tokens', 'batch_glossary_tokens', 'min_cache_tokens'):
+        if getattr(args, name) < 0:
+            print(f"Error: --{name} must not be negative.")
+            return
+
+    models = [m.strip() for m in args.models.split(',') if m.strip()]
+    if not models:
+        print("Error: No models given with --models.")
+        return
+    pricing_table = load_pricing(args.pricing)
+    unknown = [m for m in models if m not in pricing_table]
+    if unknown:
+        print(f"Error: No pricing for model(s): {', '.join(unknown)}")
+        print("Please provide prices with --pricing.")
+        return
+
+    try:
+        default_deadline = parse_deadline(args.deadline)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    jobs = collect_jobs(args.inputs, args.jobs, default_deadline, args.priority)
+    if not jobs:
+        print("No subtitle files to translate. Exiting.")
+        return
+    jobs.sort(key=TranslationJob.sort_key)
+
+    budget = ContextBudget(args.context_tokens, args.glossary_tokens, args.batch_glossary_tokens)
+    # Estimate tokens per batch up front for every batch size we may pick; the glossary
+    # prefix is built per file from the terms it uses, as translate_with_glossary() does
+    glossary = load_glossary(args.glossary)
+    for job in jobs:
+        file_text = "\n".join(sub.text for sub in job.subtitles)
+        glossary_block, extra_terms = budget.fit_glossary(glossary, file_text)
+        prefix_tokens = estimate_tokens(build_system_prompt(glossary_block))
+        batch_glossary_tokens = args.batch_glossary_tokens if extra_terms else 0
+        for batch_size in BATCH_SIZE_CHOICES:
+            batches = create_batch_groups(job.subtitles, batch_size=batch_size)
+            job.estimates[batch_size] = estimate_batch_tokens(
+                batches, prefix_tokens, args.context_tokens, batch_glossary_tokens, args.min_cache_tokens)
+
+    plan = plan_schedule(jobs, models, pricing_table, args.budget, args.max_concurrency)
+
+    print("=== 字幕翻译调度 (SRT Translation Scheduler) ===")
+    print(f"任务数量: {len(jobs)}")
+    print(f"使用模型: {plan['model']}")
+    print(f"批处理大小: {plan['batch_size']}")
+    print(f"并发数: {plan['concurrency']}")
+    print(f"预计费用: ${plan['cost']:.4f}" + (f" (预算 ${args.budget:.4f})" if args.budget is not None else ""))
+    print(f"预计完成: {plan['finish_time']:%Y-%m-%d %H:%M:%S}")
+    if not plan["feasible"]:
+        print("Warning: No plan meets every deadline within the budget.")
+        for job in plan["late_jobs"]:
+            print(f"  Likely late: {job.input_path} (deadline {job.deadline:%Y-%m-%d %H:%M})")
+    print()
+
+    if args.budget is not None and plan["cost"] > args.budget and not args.allow_over_budget:
+        print(f"Error: Predicted cost ${plan['cost']:.4f} exceeds the ${args.budget:.4f} budget.")
+        print("Raise --budget, use cheaper models, or pass --allow_over_budget to run anyway.")
+        return
+
+    if args.dry_run:
+        return
+
+    if not API_KEY:
+        print("Error: OPENAI_API_KEY environment variable not found.")
+        print("Please create a .env file and add your API key.")
+        return
+
+    print("Initializing OpenAI client...")
+    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+    tracker = ScheduleTracker(jobs, plan, models, pricing_table, args.budget,
+                              enforce_budget=not args.allow_over_budget,
+                              max_concurrency=args.max_concurrency)
+
+    def run_worker():
+        # Jobs are taken from one ordered queue so they start in the planned order
+        while True:
+            job = tracker.next_job()
+            if job is None:
+                return
+            try:
+                translate_job(job)
+            finally:
+                tracker.release_slot()
+
+    def translate_job(job):
+        model, usage_stats = tracker.choose_model(job)
+        if model is None:
+            return
+        print(f"Translating {job.input_path} with {model}...")
+        translated_subtitles = translate_with_glossary(
+            job.subtitles,
+            client,
+            model,
+            args.temperature,
+            budget=budget,
+            usage_stats=usage_stats,
+            batch_size=plan["batch_size"],
+            on_batch=lambda number, total, elapsed: tracker.on_batch(job, number, elapsed),
+            glossary=glossary,
+            log_prefix=f"[{os.path.basename(job.input_path)}] "
+        )
+        if len(translated_subtitles) < len(job.subtitles):
+            print(f"Not writing {job.output_path}: translation stopped early.")
+            return
+        write_srt(job.output_path, translated_subtitles)
+        print(f"Finished {job.output_path}")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=tracker.max_concurrency) as executor:
+        for future in [executor.submit(run_worker) for _ in range(tracker.max_concurrency)]:
+            future.result()
+
+    unfinished = len(tracker.skipped_jobs) + len(tracker.stopped_jobs)
+    if unfinished:
+        print(f"Budget reached: {unfinished} of {len(jobs)} files were not translated.")
+    else:
+        print("All jobs complete!")
+    print(f"Translated {len(jobs) - unfinished} files in {time.time() - start:.0f}s for ${tracker.spent():.4f}.")
+
+if __name__ == "__main__":
+    main()
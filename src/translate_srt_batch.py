@@ -2,6 +2,7 @@ import os
 import re
 import argparse
 import json
+import time
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -13,6 +14,21 @@ API_KEY = os.getenv("OPENAI_API_KEY")
 BASE_URL = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-3.5-turbo")
 DEFAULT_TEMPERATURE = float(os.getenv("DEFAULT_TEMPERATURE", 0.7))
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("DEFAULT_CONTEXT_TOKENS", 300))
+DEFAULT_GLOSSARY_TOKENS = int(os.getenv("DEFAULT_GLOSSARY_TOKENS", 2000))
+DEFAULT_BATCH_GLOSSARY_TOKENS = int(os.getenv("DEFAULT_BATCH_GLOSSARY_TOKENS", 200))
+
+# Kept as a module-level constant so every request starts with a byte-identical
+# prefix, which lets provider-side prompt caching reuse it across batches.
+SYSTEM_PROMPT = """你是一位专业的字幕翻译专家。请按照以下要求翻译字幕：
+
+1. 保持翻译的一致性和连贯性
+2. 确保专有名词、人名、地名的翻译统一
+3. 保持对话的自然流畅
+4. 保留原文的语气和情感
+5. 返回格式必须与输入格式完全一致（数字编号 + 翻译内容）
+
+请将用户消息中"当前待翻译内容"部分的英文字幕翻译成简体中文，保持编号不变。"""
 
 # --- SRT Parsing and Generation ---
 
@@ -101,9 +117,145 @@ def create_batch_groups(subtitles, batch_size=10, max_chars=3000):
     
     return batches
 
-def translate_batch(batch, client, model_name, temperature, context_memory=""):
+# --- Prompt Layout and Context Budget ---
+
+def estimate_tokens(text):
+    """
+    Roughly estimates the token count of a piece of text.
+
+    CJK characters are counted as one token each, everything else as
+    four characters per token. Good enough for budgeting without a tokenizer.
+    """
+    if not text:
+        return 0
+    cjk_chars = len(re.findall(r'[\u3000-\u9fff\uff00-\uffef]', text))
+    other_chars = len(text) - cjk_chars
+    return cjk_chars + (other_chars + 3) // 4
+
+def compile_glossary(glossary):
+    """
+    Compiles a case-insensitive whole-term pattern for each glossary entry.
+
+    Lookarounds are used instead of \\b so terms such as "C++" or ".NET" still match.
+
+    Returns:
+        List of (en_term, cn_term, pattern) tuples sorted by term
+    """
+    return [(en_term, cn_term, re.compile(r'(?<!\w)' + re.escape(en_term) + r'(?!\w)', re.IGNORECASE))
+            for en_term, cn_term in sorted(glossary.items())]
+
+class ContextBudget:
+    """
+    Caps the context memory and glossary slices sent with each batch to a token allowance.
+
+    glossary_tokens applies to the fixed block in the cached prefix and
+    batch_glossary_tokens to the terms matched per batch, so a request carries
+    at most the sum of the two.
+    """
+    def __init__(self, context_tokens=DEFAULT_CONTEXT_TOKENS, glossary_tokens=DEFAULT_GLOSSARY_TOKENS,
+                 batch_glossary_tokens=DEFAULT_BATCH_GLOSSARY_TOKENS):
+        self.context_tokens = context_tokens
+        self.glossary_tokens = glossary_tokens
+        self.batch_glossary_tokens = batch_glossary_tokens
+
+    def fit_glossary(self, glossary, file_text=None):
+        """
+        Selects the fixed glossary slice that goes into the cached prefix.
+
+        If file_text is given, only terms that occur in it are kept. Terms are
+        sorted so the slice is byte-identical for every batch of a file.
+
+        Returns:
+            Tuple of (glossary_block, remaining_terms), where remaining_terms is a
+            list of (en_term, cn_term, pattern) for fit_batch_glossary()
+        """
+        lines = []
+        remaining = []
+        used = 0
+        for en_term, cn_term, pattern in compile_glossary(glossary):
+            if file_text is not None and not pattern.search(file_text):
+                continue
+            line = f"- {en_term} → {cn_term}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.glossary_tokens:
+                remaining.append((en_term, cn_term, pattern))
+                continue
+            lines.append(line)
+            used += cost
+
+        if not lines:
+            return "", remaining
+        return "术语对照表：\n" + "\n".join(lines), remaining
+
+    def fit_batch_glossary(self, terms, batch_text):
+        """Picks the terms left out of the fixed block that actually occur in this batch."""
+        lines = []
+        used = 0
+        for en_term, cn_term, pattern in terms:
+            if not pattern.search(batch_text):
+                continue
+            line = f"- {en_term} → {cn_term}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.batch_glossary_tokens:
+                continue
+            lines.append(line)
+            used += cost
+        return "\n".join(lines)
+
+    def fit_context(self, context_memory):
+        """Keeps the most recent lines of context memory that fit the allowance."""
+        kept = []
+        used = 0
+        for line in reversed(context_memory.split('\n')):
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.context_tokens:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
+
+def build_system_prompt(glossary_block=""):
+    """Builds the stable per-file prefix: the system prompt followed by the fixed glossary block."""
+    if not glossary_block:
+        return SYSTEM_PROMPT
+    return f"{SYSTEM_PROMPT}\n\n{glossary_block}"
+
+def record_usage(usage_stats, response):
+    """
+    Accumulates token usage, including provider-side cached prompt tokens, from response.usage.
+
+    Returns:
+        Tuple of (prompt_tokens, cached_tokens) for this request
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0
+
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    if not cached_tokens:
+        # Some OpenAI-compatible providers (e.g. DeepSeek) report cache hits here instead
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", 0) or 0
+
+    if usage_stats is not None:
+        usage_stats["requests"] = usage_stats.get("requests", 0) + 1
+        usage_stats["prompt_tokens"] = usage_stats.get("prompt_tokens", 0) + prompt_tokens
+        usage_stats["cached_tokens"] = usage_stats.get("cached_tokens", 0) + cached_tokens
+        usage_stats["completion_tokens"] = usage_stats.get("completion_tokens", 0) + completion_tokens
+
+    return prompt_tokens, cached_tokens
+
+def translate_batch(batch, client, model_name, temperature, context_memory="",
+                    system_prompt=SYSTEM_PROMPT, extra_terms=None, budget=None, usage_stats=None,
+                    log_prefix=""):
     """
     Translates a batch of subtitles with context awareness.
+
+    The messages are laid out so that the stable part (system prompt and fixed
+    glossary block) comes first and the varying part (recent translations,
+    batch-specific terms and the batch itself) follows.
     
     Args:
         batch: List of Subtitle objects to translate
@@ -111,12 +263,20 @@ def translate_batch(batch, client, model_name, temperature, context_memory=""):
         model_name: Model to use for translation
         temperature: Temperature for translation
         context_memory: Previous context to maintain consistency
+        system_prompt: Stable per-file prefix, see build_system_prompt()
+        extra_terms: Glossary terms not included in the fixed prefix, as returned by ContextBudget.fit_glossary()
+        budget: ContextBudget capping the varying context; defaults are used if None
+        usage_stats: Optional dict accumulating token usage across batches
+        log_prefix: Text put before each progress line, e.g. the file name
     
     Returns:
         Tuple of (translated_texts, updated_context_memory)
     """
     if not batch:
         return [], context_memory
+
+    if budget is None:
+        budget = ContextBudget()
     
     # Prepare the input for batch translation
     input_texts = []
@@ -124,21 +284,17 @@ def translate_batch(batch, client, model_name, temperature, context_memory=""):
         input_texts.append(f"{i}. {subtitle.text}")
     
     batch_text = "\n".join(input_texts)
-    
-    # Create context-aware prompt
-    system_prompt = """你是一位专业的字幕翻译专家。请按照以下要求翻译字幕：
-
-1. 保持翻译的一致性和连贯性
-2. 确保专有名词、人名、地名的翻译统一
-3. 保持对话的自然流畅
-4. 保留原文的语气和情感
-5. 返回格式必须与输入格式完全一致（数字编号 + 翻译内容）
 
-请将以下英文字幕翻译成简体中文，保持编号不变："""
-
-    user_prompt = batch_text
-    if context_memory:
-        user_prompt = f"上下文参考（保持翻译一致性）：\n{context_memory}\n\n当前待翻译内容：\n{batch_text}"
+    # Varying parts go after the cached prefix, capped to the token allowance
+    sections = []
+    batch_terms = budget.fit_batch_glossary(extra_terms, batch_text) if extra_terms else ""
+    if batch_terms:
+        sections.append(f"本段补充术语：\n{batch_terms}")
+    context = budget.fit_context(context_memory) if context_memory else ""
+    if context:
+        sections.append(f"上下文参考（保持翻译一致性）：\n{context}")
+    sections.append(f"当前待翻译内容：\n{batch_text}")
+    user_prompt = "\n\n".join(sections)
     
     try:
         response = client.chat.completions.create(
@@ -149,6 +305,10 @@ def translate_batch(batch, client, model_name, temperature, context_memory=""):
             ],
             temperature=temperature,
         )
+
+        prompt_tokens, cached_tokens = record_usage(usage_stats, response)
+        if prompt_tokens:
+            print(f"{log_prefix}  Prompt tokens: {prompt_tokens} (cached: {cached_tokens})")
         
         translated_content = response.choices[0].message.content.strip()
         
@@ -174,11 +334,25 @@ def translate_batch(batch, client, model_name, temperature, context_memory=""):
         return translated_texts[:len(batch)], updated_context_memory
         
     except Exception as e:
-        print(f"An error occurred during batch translation: {e}")
+        print(f"{log_prefix}An error occurred during batch translation: {e}")
         error_texts = [f"[Translation Error: {sub.text}]" for sub in batch]
         return error_texts, context_memory
 
-def translate_with_glossary(subtitles, client, model_name, temperature, glossary_file=None):
+def load_glossary(glossary_file):
+    """Loads a JSON glossary of term translations, returning an empty dict if unavailable."""
+    glossary = {}
+    if glossary_file and os.path.exists(glossary_file):
+        try:
+            with open(glossary_file, 'r', encoding='utf-8') as f:
+                glossary = json.load(f)
+            print(f"Loaded glossary with {len(glossary)} terms from {glossary_file}")
+        except Exception as e:
+            print(f"Warning: Could not load glossary file {glossary_file}: {e}")
+    return glossary
+
+def translate_with_glossary(subtitles, client, model_name, temperature, glossary_file=None,
+                            budget=None, usage_stats=None, batch_size=10, on_batch=None,
+                            glossary=None, log_prefix=""):
     """
     Advanced translation with optional glossary support for consistent terminology.
     
@@ -188,39 +362,47 @@ def translate_with_glossary(subtitles, client, model_name, temperature, glossary
         model_name: Model name
         temperature: Temperature setting
         glossary_file: Optional path to JSON file with term translations
+        budget: Optional ContextBudget for the context memory and glossary slices
+        usage_stats: Optional dict accumulating token usage across batches
+        batch_size: Maximum number of subtitles per batch
+        on_batch: Optional callback(batch_number, total_batches, elapsed_seconds) run after each batch;
+            returning False stops before the next batch
+        glossary: Optional already loaded glossary dict, used instead of glossary_file
+        log_prefix: Text put before each progress line, e.g. the file name
     
     Returns:
-        List of translated Subtitle objects
+        List of translated Subtitle objects, shorter than subtitles if on_batch stopped the run
     """
-    # Load glossary if provided
-    glossary = {}
-    if glossary_file and os.path.exists(glossary_file):
-        try:
-            with open(glossary_file, 'r', encoding='utf-8') as f:
-                glossary = json.load(f)
-            print(f"Loaded glossary with {len(glossary)} terms from {glossary_file}")
-        except Exception as e:
-            print(f"Warning: Could not load glossary file {glossary_file}: {e}")
+    if budget is None:
+        budget = ContextBudget()
+
+    if glossary is None:
+        glossary = load_glossary(glossary_file)
     
     # Create batches
-    batches = create_batch_groups(subtitles)
-    print(f"Created {len(batches)} batches for translation")
+    batches = create_batch_groups(subtitles, batch_size=batch_size)
+    print(f"{log_prefix}Created {len(batches)} batches for translation")
     
     translated_subtitles = []
     context_memory = ""
     
-    # Add glossary to initial context if available
+    # Build the stable prefix once per file from the terms it uses, so every batch can hit the prompt cache
+    file_text = "\n".join(sub.text for sub in subtitles)
+    glossary_block, extra_terms = budget.fit_glossary(glossary, file_text)
+    system_prompt = build_system_prompt(glossary_block)
     if glossary:
-        glossary_context = "术语对照表：\n"
-        for en_term, cn_term in glossary.items():
-            glossary_context += f"- {en_term} → {cn_term}\n"
-        context_memory = glossary_context
+        prefix_terms = glossary_block.count("\n")
+        print(f"{log_prefix}{prefix_terms} glossary terms used in this file are in the cached prefix, "
+              f"{len(extra_terms)} more matched per batch")
     
     for i, batch in enumerate(batches):
-        print(f"Translating batch {i+1}/{len(batches)} ({len(batch)} subtitles)...")
+        print(f"{log_prefix}Translating batch {i+1}/{len(batches)} ({len(batch)} subtitles)...")
+        batch_start = time.time()
         
         translated_texts, context_memory = translate_batch(
-            batch, client, model_name, temperature, context_memory
+            batch, client, model_name, temperature, context_memory,
+            system_prompt=system_prompt, extra_terms=extra_terms,
+            budget=budget, usage_stats=usage_stats, log_prefix=log_prefix
         )
         
         # Create translated subtitle objects
@@ -232,6 +414,10 @@ def translate_with_glossary(subtitles, client, model_name, temperature, glossary
                 text=translated_text
             )
             translated_subtitles.append(translated_sub)
+
+        if on_batch and on_batch(i + 1, len(batches), time.time() - batch_start) is False:
+            print(f"{log_prefix}Stopped after batch {i+1}/{len(batches)}.")
+            break
     
     return translated_subtitles
 
@@ -246,6 +432,9 @@ def main():
     parser.add_argument('-t', '--temperature', type=float, default=DEFAULT_TEMPERATURE, help=f'The temperature for translation. Defaults to {DEFAULT_TEMPERATURE}.')
     parser.add_argument('-g', '--glossary', help='Optional JSON glossary file for consistent terminology translation.')
     parser.add_argument('-b', '--batch_size', type=int, default=10, help='Number of subtitles per batch (default: 10).')
+    parser.add_argument('--context_tokens', type=int, default=DEFAULT_CONTEXT_TOKENS, help=f'Token allowance for context memory per batch. Defaults to {DEFAULT_CONTEXT_TOKENS}.')
+    parser.add_argument('--glossary_tokens', type=int, default=DEFAULT_GLOSSARY_TOKENS, help=f'Token allowance for the fixed glossary block in the cached prefix. Defaults to {DEFAULT_GLOSSARY_TOKENS}.')
+    parser.add_argument('--batch_glossary_tokens', type=int, default=DEFAULT_BATCH_GLOSSARY_TOKENS, help=f'Token allowance for glossary terms matched per batch outside the fixed block. Defaults to {DEFAULT_BATCH_GLOSSARY_TOKENS}.')
     
     args = parser.parse_args()
 
@@ -284,12 +473,17 @@ def main():
     print(f"Found {len(original_subtitles)} subtitle entries to translate.")
     print("Starting intelligent batch translation with context awareness...")
     
+    budget = ContextBudget(args.context_tokens, args.glossary_tokens, args.batch_glossary_tokens)
+    usage_stats = {}
     translated_subtitles = translate_with_glossary(
         original_subtitles, 
         client, 
         args.model, 
         args.temperature,
-        args.glossary
+        args.glossary,
+        budget=budget,
+        usage_stats=usage_stats,
+        batch_size=args.batch_size
     )
 
     print(f"Writing translated subtitles to: {output_path}")
@@ -297,6 +491,11 @@ def main():
     
     print("Translation complete!")
     print(f"Translated {len(translated_subtitles)} subtitles with improved context awareness.")
+    if usage_stats.get("prompt_tokens"):
+        cached_ratio = usage_stats["cached_tokens"] / usage_stats["prompt_tokens"]
+        print(f"Token usage: {usage_stats['prompt_tokens']} prompt "
+              f"({usage_stats['cached_tokens']} cached, {cached_ratio:.0%}), "
+              f"{usage_stats['completion_tokens']} completion")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file